@@ -48,11 +48,26 @@ class DDLCommand(Enum):
     SHOW = "SHOW"
 
 
-OPENDIC_EXPS = {
+# Frozen, these are shared by every experiment module and never change at runtime
+OPENDIC_EXPS: frozenset[DatabaseSystem] = frozenset({
     DatabaseSystem.OPENDIC_POLARIS_AZURE_CACHED,
     DatabaseSystem.OPENDIC_POLARIS_AZURE_CACHED_BATCH,
     DatabaseSystem.OPENDIC_POLARIS_FILE,
     DatabaseSystem.OPENDIC_POLARIS_FILE_CACHED,
     DatabaseSystem.OPENDIC_POLARIS_FILE_CACHED_BATCH,
     DatabaseSystem.OPENDIC_POLARIS_FILE_BATCH,
-}
+})
+
+# OpenDic deployments benchmarked through the bulk "CREATE OPEN BATCH" endpoint
+OPENDIC_BATCH_EXPS: frozenset[DatabaseSystem] = frozenset({
+    DatabaseSystem.OPENDIC_POLARIS_FILE_BATCH,
+    DatabaseSystem.OPENDIC_POLARIS_FILE_CACHED_BATCH,
+    DatabaseSystem.OPENDIC_POLARIS_AZURE_CACHED_BATCH,
+})
+
+# Systems that can have several queries in flight at once. Postgres gets a connection per thread, the others share theirs
+CONCURRENT_EXPS: frozenset[DatabaseSystem] = OPENDIC_EXPS | {DatabaseSystem.SNOWFLAKE, DatabaseSystem.POSTGRES}
+
+# Remote systems whose sequential CREATE loops build the next queries on a background thread. Local systems, including the
+# benchmark's Postgres, build inline: their round trips are shorter than a thread hand-off
+PREFETCH_EXPS: frozenset[DatabaseSystem] = OPENDIC_EXPS | {DatabaseSystem.SNOWFLAKE}
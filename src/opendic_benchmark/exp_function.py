@@ -1,18 +1,92 @@
 import random
+from collections.abc import Callable
+from contextlib import closing, nullcontext
 
-from opendic_benchmark.consts import OPENDIC_EXPS
-from opendic_benchmark.experiment_logger.data_recorder import (
+from opendic_benchmark.consts import (
+    CONCURRENT_EXPS,
+    OPENDIC_BATCH_EXPS,
+    OPENDIC_EXPS,
+    PREFETCH_EXPS,
     DatabaseObject,
     DatabaseSystem,
-    DataRecorder,
     DDLCommand,
     Granularity,
 )
-from opendic_benchmark.runner import execute_timed_query
+from opendic_benchmark.experiment_logger.data_recorder import DataRecorder
+from opendic_benchmark.opendic_props import FUNCTION_SCHEMA, dumps, function_props, function_props_json
+from opendic_benchmark.runner import (
+    execute_timed_batch,
+    execute_timed_queries_concurrently,
+    execute_timed_query,
+    open_cursor,
+    prefetch_queries,
+    prepare_postgres_statement,
+)
+
+_OPENDIC_DEFINE_FUNCTION = f"DEFINE OPEN function PROPS {dumps(FUNCTION_SCHEMA)}"
+
+
+def _opendic_create_function(idx: int, num_exp: int = 0) -> str:
+    return f"CREATE OPEN function f_{idx} PROPS {dumps(function_props(idx))}"
+
+
+def _opendic_alter_function(idx: int, num_exp: int = 0) -> str:
+    return f"ALTER OPEN function f_{idx} PROPS {dumps(function_props(idx, definition='SELECT a + b + 42'))}"
+
+
+def _opendic_comment_function(idx: int, num_exp: int = 0) -> str:
+    props = function_props(idx, comment=f"Function altered at experiment {num_exp}")
+    return f"ALTER OPEN function f_{idx} PROPS {dumps(props)}"
 
 
-def run_create_function(conn, database_system: DatabaseSystem, granularity: Granularity, recorder: DataRecorder, start_idx = 0):
-    """Create multiple function objects."""
+# Platform-specific function query builders keyed by (system, command). Called with idx= and num_exp= keywords.
+# SQLite does not support functions, so it has no entries.
+FUNCTION_QUERY_BUILDERS: dict[tuple[DatabaseSystem, DDLCommand], Callable[..., str]] = {
+    (DatabaseSystem.SNOWFLAKE, DDLCommand.CREATE): "CREATE FUNCTION f_{idx}(a INT, b INT) RETURNS INT LANGUAGE SQL AS $$ a + b $$;".format,
+    (DatabaseSystem.DUCKDB, DDLCommand.CREATE): "CREATE MACRO f_{idx}(a, b) AS a + b;".format,
+    (DatabaseSystem.POSTGRES, DDLCommand.CREATE): "CREATE FUNCTION f_{idx}(a integer, b integer) RETURNS integer LANGUAGE SQL RETURN a + b;".format,
+    (DatabaseSystem.SNOWFLAKE, DDLCommand.ALTER): "CREATE OR REPLACE FUNCTION f_{idx}(a INT, b INT) RETURNS INT LANGUAGE SQL AS $$ a + b + 42 $$;".format,
+    (DatabaseSystem.DUCKDB, DDLCommand.ALTER): "CREATE OR REPLACE MACRO f_{idx}(a, b) AS a + b + 42;".format,
+    (DatabaseSystem.POSTGRES, DDLCommand.ALTER): "CREATE OR REPLACE FUNCTION f_{idx}(a integer, b integer) RETURNS integer LANGUAGE SQL RETURN a + b + 42;".format,
+    # Snowflake needs the argument types to resolve the function
+    (DatabaseSystem.SNOWFLAKE, DDLCommand.COMMENT): "COMMENT ON FUNCTION f_{idx}(INT, INT) IS 'Function altered at experiment {num_exp}';".format,
+    (DatabaseSystem.DUCKDB, DDLCommand.COMMENT): "COMMENT ON MACRO f_{idx} IS 'Function altered at experiment {num_exp}';".format,
+    (DatabaseSystem.POSTGRES, DDLCommand.COMMENT): "COMMENT ON FUNCTION f_{idx} IS 'Function altered at experiment {num_exp}';".format,
+    **{(system, DDLCommand.CREATE): _opendic_create_function for system in OPENDIC_EXPS},
+    **{(system, DDLCommand.ALTER): _opendic_alter_function for system in OPENDIC_EXPS},
+    **{(system, DDLCommand.COMMENT): _opendic_comment_function for system in OPENDIC_EXPS},
+}
+
+# Postgres creates a whole batch server-side in one short DO statement instead of receiving every CREATE
+_POSTGRES_CREATE_FUNCTION_BATCH = (
+    "DO $$ BEGIN FOR i IN {first}..{last} LOOP "
+    "EXECUTE format('CREATE FUNCTION f_%s(a integer, b integer) RETURNS integer LANGUAGE SQL RETURN a + b;', i); "
+    "END LOOP; END $$;"
+)
+
+# Largest number of objects sent in one CREATE OPEN BATCH request, same split as create_tables_batch
+_OPENDIC_MAX_BATCH = 10_000
+
+
+def run_create_function(
+    conn,
+    database_system: DatabaseSystem,
+    granularity: Granularity,
+    recorder: DataRecorder,
+    start_idx=0,
+    batch_size=1,
+    concurrency=1,
+):
+    """Create multiple function objects.
+    With batch_size > 1 the CREATE statements are sent in multi-statement batches (standard systems only) and one record
+    is written per batch, with the index of the last function in the batch as granularity. Postgres runs each batch
+    server-side as a single DO block.
+    OpenDic *_BATCH systems always create the functions with CREATE OPEN BATCH requests of up to 10,000 objects, with one
+    record per request. Like create_tables_batch, every request is recorded at the run's granularity. Concurrency then
+    applies to the batch requests.
+    With concurrency > 1 up to that many CREATE statements are in flight at once (Postgres, Snowflake and opendic only). Each
+    statement is still timed and recorded individually."""
+    num_objects = granularity.value
     if database_system == DatabaseSystem.DUCKDB:
         init_query = """CREATE schema experiment;
                         USE experiment;"""
@@ -21,70 +95,97 @@ def run_create_function(conn, database_system: DatabaseSystem, granularity: Gran
         execute_timed_query(conn, database_system, "CREATE OR REPLACE SCHEMA metadata_experiment;")
         execute_timed_query(conn, database_system, "USE SCHEMA metadata_experiment;")
     elif database_system in OPENDIC_EXPS:
-        init_query = """
-        DEFINE OPEN function
-        PROPS {
-            "name": "string",
-            "language": "string",
-            "args": "map",
-            "definition": "string",
-            "comment": "string"
-        }
-        """
-        execute_timed_query(conn, database_system, init_query)
+        execute_timed_query(conn, database_system, _OPENDIC_DEFINE_FUNCTION)
 
-    for i in range(start_idx ,granularity.value):
-        if database_system in OPENDIC_EXPS:
-            query = f"""
-            CREATE OPEN function f_{i}
-            PROPS {{
-              "name": "f_{i}",
-              "language": "sql",
-              "args": {{"a": "int", "b": "int"}},
-              "definition": "SELECT a + b",
-              "comment": ""
-            }}
-            """
-        # Here we have to conform to platform-specific syntax
-        elif database_system == DatabaseSystem.SNOWFLAKE:
-            query = f"CREATE FUNCTION f_{i}(a INT, b INT) RETURNS INT LANGUAGE SQL AS $$ a + b $$;"
-        elif database_system == DatabaseSystem.DUCKDB:
-            query = f"CREATE MACRO f_{i}(a, b) AS a + b;"
-        elif database_system == DatabaseSystem.POSTGRES:
-            query = f"CREATE FUNCTION f_{i}(a integer, b integer) RETURNS integer LANGUAGE SQL RETURN a + b;"
-        else:
-            # SQLite does not support functions
-            continue
+    # Pick the platform-specific builder once, only the index varies per query
+    build_create = FUNCTION_QUERY_BUILDERS.get((database_system, DDLCommand.CREATE))
+    if build_create is None:
+        # SQLite does not support functions
+        return
+
+    if batch_size > 1 and database_system == DatabaseSystem.POSTGRES:
+        for first in range(start_idx, num_objects, batch_size):
+            last = min(first + batch_size, num_objects) - 1
+            query = _POSTGRES_CREATE_FUNCTION_BATCH.format(first=first, last=last)
+            start, end, duration = execute_timed_query(conn, database_system, query)
+            recorder.record(
+                database_system, DDLCommand.CREATE, query, DatabaseObject.FUNCTION, last, 0, duration.total_seconds(), start, end
+            )
+        return
 
-        start, end, duration = execute_timed_query(conn, database_system, query)
-        recorder.record(
-            database_system, DDLCommand.CREATE, query, DatabaseObject.FUNCTION, i, 0, duration.total_seconds(), start, end
+    if database_system in OPENDIC_BATCH_EXPS:
+        ranges = [
+            (first, min(first + _OPENDIC_MAX_BATCH, num_objects) - 1)
+            for first in range(start_idx, num_objects, _OPENDIC_MAX_BATCH)
+        ]
+        queries = (
+            "CREATE OPEN BATCH function OBJECTS [" + ",".join([function_props_json(i) for i in range(first, last + 1)]) + "]"
+            for first, last in ranges
         )
+        if concurrency > 1:
+            timings = execute_timed_queries_concurrently(conn, database_system, queries, concurrency)
+        else:
+            timings = (execute_timed_query(conn, database_system, query) for query in queries)
+        with closing(timings):
+            for (first, last), (start, end, duration) in zip(ranges, timings):
+                # Do not log the whole payload, only which functions it created
+                recorder.record(
+                    database_system,
+                    DDLCommand.CREATE,
+                    f"CREATE OPEN BATCH function OBJECTS [f_{first} .. f_{last}]",
+                    DatabaseObject.FUNCTION,
+                    num_objects,
+                    0,
+                    duration.total_seconds(),
+                    start,
+                    end,
+                )
+        return
 
+    indices = range(start_idx, num_objects)
+    if concurrency > 1 and database_system in CONCURRENT_EXPS:
+        queries = [build_create(idx=i) for i in indices]
+        timings = execute_timed_queries_concurrently(conn, database_system, queries, concurrency)
+        with closing(timings):
+            for i, query, (start, end, duration) in zip(indices, queries, timings):
+                recorder.record(
+                    database_system, DDLCommand.CREATE, query, DatabaseObject.FUNCTION, i, 0, duration.total_seconds(), start, end
+                )
+        return
 
-def run_alter_function(conn, database_system: DatabaseSystem, granularity: Granularity, recorder: DataRecorder, num_exp: int):
-    """Alter a random function object."""
-    idx = random.randint(0, granularity.value - 1)
-    if database_system in OPENDIC_EXPS:
-        query = f"""
-        ALTER OPEN function f_{idx}
-        PROPS {{
-          "name": "f_{idx}",
-          "language": "sql",
-          "args": {{"a": "int", "b": "int"}},
-          "definition": "SELECT a + b + 42",
-          "comment": ""
-        }}
-        """
-    elif database_system == DatabaseSystem.SNOWFLAKE:
-        query = f"CREATE OR REPLACE FUNCTION f_{idx}(a INT, b INT) RETURNS INT LANGUAGE SQL AS $$ a + b + 42 $$;"
-    elif database_system == DatabaseSystem.DUCKDB:
-        query = f"CREATE OR REPLACE MACRO f_{idx}(a, b) AS a + b + 42;"
-    elif database_system == DatabaseSystem.POSTGRES:
-        query = f"CREATE OR REPLACE FUNCTION f_{idx}(a integer, b integer) RETURNS integer LANGUAGE SQL RETURN a + b + 42;"
-    else:
+    queries = (build_create(idx=i) for i in indices)
+    # Remote round trips dominate, so build the next queries meanwhile. Closed with the loop, which stops the producer
+    prefetch = closing(prefetch_queries(queries)) if database_system in PREFETCH_EXPS else nullcontext(queries)
+
+    batched = batch_size > 1 and database_system not in OPENDIC_EXPS
+    batch: list[str] = []
+    # Loop invariants looked up once, the loop runs up to 100k times
+    record, create, function = recorder.record, DDLCommand.CREATE, DatabaseObject.FUNCTION
+    with prefetch as queries, open_cursor(conn, database_system) as cursor:
+        for i, query in zip(indices, queries):
+            if batched:
+                batch.append(query)
+                if len(batch) < batch_size and i < num_objects - 1:
+                    continue
+                start, end, duration = execute_timed_batch(conn, database_system, batch)
+                query = "\n".join(batch)
+                batch = []
+            else:
+                start, end, duration = execute_timed_query(conn, database_system, query, cursor=cursor)
+            record(database_system, create, query, function, i, 0, duration.total_seconds(), start, end)
+
+
+def run_alter_function(
+    conn, database_system: DatabaseSystem, granularity: Granularity, recorder: DataRecorder, num_exp: int, idx=None
+):
+    """Alter function object `idx`, or a random one if not given."""
+    if idx is None:
+        idx = random.randrange(granularity.value)
+    build_alter = FUNCTION_QUERY_BUILDERS.get((database_system, DDLCommand.ALTER))
+    if build_alter is None:
         # SQLite does not support functions
         return
+    query = build_alter(idx=idx, num_exp=num_exp)
 
     start, end, duration = execute_timed_query(conn, database_system, query)
     recorder.record(
@@ -100,32 +201,17 @@ def run_alter_function(conn, database_system: DatabaseSystem, granularity: Granu
     )
 
 
-def run_comment_function(conn, database_system: DatabaseSystem, granularity: Granularity, recorder: DataRecorder, num_exp: int):
-    """Comment or describe a function."""
-    idx = random.randint(0, granularity.value - 1)
-    if database_system in OPENDIC_EXPS:
-        query = f"""
-        ALTER OPEN function f_{idx}
-        PROPS {{
-          "name": "f_{idx}",
-          "language": "sql",
-          "args": {{"a": "int", "b": "int"}},
-          "definition": "SELECT a + b",
-          "comment": "Function altered at experiment {num_exp}"
-        }}
-        """
-    # Snowflake and Postgres have the same syntax for comments
-    elif database_system == DatabaseSystem.POSTGRES:
-        query = f"COMMENT ON FUNCTION f_{idx} IS 'Function altered at experiment {num_exp}';"
-
-    elif database_system == DatabaseSystem.SNOWFLAKE:
-        query = f"COMMENT ON FUNCTION f_{idx}(INT, INT) IS 'Function altered at experiment {num_exp}';"
-
-    elif database_system == DatabaseSystem.DUCKDB:
-        query = f"COMMENT ON MACRO f_{idx} IS 'Function altered at experiment {num_exp}';"
-    else:
+def run_comment_function(
+    conn, database_system: DatabaseSystem, granularity: Granularity, recorder: DataRecorder, num_exp: int, idx=None
+):
+    """Comment or describe function object `idx`, or a random one if not given."""
+    if idx is None:
+        idx = random.randrange(granularity.value)
+    build_comment = FUNCTION_QUERY_BUILDERS.get((database_system, DDLCommand.COMMENT))
+    if build_comment is None:
         # SQLite does not support functions
         return
+    query = build_comment(idx=idx, num_exp=num_exp)
 
     start, end, duration = execute_timed_query(conn, database_system, query)
     recorder.record(
@@ -141,23 +227,30 @@ def run_comment_function(conn, database_system: DatabaseSystem, granularity: Gra
     )
 
 
+_POSTGRES_SHOW_FUNCTIONS = """
+            SELECT n.nspname AS schema, p.proname AS function_name
+            FROM pg_proc p
+            JOIN pg_namespace n ON n.oid = p.pronamespace
+            WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+            AND p.prokind = 'f'
+            AND p.proname LIKE 'f_%'
+            """
+
+
 def run_show_functions(
     conn,
     database_system: DatabaseSystem,
     granularity: Granularity,
     recorder: DataRecorder,
     num_exp: int,
+    prepared=False,
 ):
-    """Show function objects across supported systems."""
-    if database_system == DatabaseSystem.POSTGRES:
-        query = """
-            SELECT n.nspname AS schema, p.proname AS function_name
-            FROM pg_proc p
-            JOIN pg_namespace n ON n.oid = p.pronamespace
-            WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
-            AND p.prokind = 'f'
-            AND p.proname LIKE 'f_%';
-            """
+    """Show function objects across supported systems.
+    With prepared=True Postgres plans the catalog query once per connection and each SHOW only runs EXECUTE."""
+    if database_system == DatabaseSystem.POSTGRES and prepared:
+        query = prepare_postgres_statement(conn, "show_functions", _POSTGRES_SHOW_FUNCTIONS)
+    elif database_system == DatabaseSystem.POSTGRES:
+        query = _POSTGRES_SHOW_FUNCTIONS
     elif database_system == DatabaseSystem.SNOWFLAKE:
         query = "SHOW USER FUNCTIONS limit 10000;"
     elif database_system in OPENDIC_EXPS:
@@ -181,4 +274,3 @@ def run_show_functions(
         start_time,
         end_time,
     )
-    print()
@@ -1,5 +1,6 @@
-import json
 import random
+from collections.abc import Callable
+from contextlib import closing, nullcontext
 from sqlite3 import Connection
 
 from duckdb import DuckDBPyConnection
@@ -7,11 +8,42 @@ from psycopg2.extensions import connection
 from snowflake.connector.connection import SnowflakeConnection
 from snowflake_opendic.catalog import OpenDicSnowflakeCatalog
 
-from opendic_benchmark.consts import OPENDIC_EXPS, DatabaseObject, DatabaseSystem, DDLCommand, Granularity
+from opendic_benchmark.consts import (
+    CONCURRENT_EXPS,
+    OPENDIC_BATCH_EXPS,
+    OPENDIC_EXPS,
+    DatabaseObject,
+    DatabaseSystem,
+    DDLCommand,
+    Granularity,
+)
 from opendic_benchmark.experiment_logger.data_recorder import (
     DataRecorder,
 )
-from opendic_benchmark.runner import execute_timed_query
+from opendic_benchmark.opendic_props import TABLE_SCHEMA, dumps, table_props, table_props_json
+from opendic_benchmark.runner import (
+    execute_timed_batch,
+    execute_timed_queries_concurrently,
+    execute_timed_query,
+    open_cursor,
+    prepare_postgres_statement,
+)
+
+_OPENDIC_DEFINE_TABLE = f"DEFINE OPEN table PROPS {dumps(TABLE_SCHEMA)}"
+
+
+_CREATE_TABLE_TEMPLATE = "CREATE TABLE t_{} (id INTEGER PRIMARY KEY, value TEXT);"
+
+
+def _opendic_create_table_query(i: int) -> str:
+    return f"CREATE OPEN table t_{i} PROPS {table_props_json(i)}"
+
+
+def _create_table_builder(database_system: DatabaseSystem) -> Callable[[int], str]:
+    """CREATE query builder for the system, picked once per loop. Only the table index varies per query"""
+    if database_system in OPENDIC_EXPS:
+        return _opendic_create_table_query
+    return _CREATE_TABLE_TEMPLATE.format
 
 
 def create_tables(
@@ -20,105 +52,72 @@ def create_tables(
     num_objects: Granularity,
     recorder: DataRecorder,
     logging=True,
-    start_idx
-    =0
+    start_idx=0,
+    concurrency=1,
+    batch_size=1,
 ):
-    """Example: Create 1000 tables"""
-    print()
+    """Example: Create 1000 tables.
+    With batch_size > 1 the CREATE statements are sent in multi-statement batches (standard systems only) and one record
+    is written per batch, with the index of the last table in the batch as granularity.
+    With concurrency > 1 up to that many CREATE statements are in flight at once (Postgres, Snowflake and opendic only). Each
+    statement is still timed and recorded individually."""
 
     if database_system == DatabaseSystem.DUCKDB:
         init_query = """CREATE schema experiment;
                         use experiment;"""
         _ = execute_timed_query(conn, query=init_query, database_system=database_system)
     elif database_system == DatabaseSystem.SNOWFLAKE and isinstance(conn, SnowflakeConnection):
+        # One round trip. The connection is reused for the whole loop, so the schema context holds for every CREATE
         with conn.cursor() as curs:
-            curs.execute("CREATE or replace SCHEMA metadata_experiment")
-            curs.execute("use schema metadata_experiment;")
+            curs.execute("CREATE or replace SCHEMA metadata_experiment; use schema metadata_experiment;", num_statements=2)
 
     elif database_system in OPENDIC_EXPS and start_idx == 0:
-        init_query: str = """
-        DEFINE OPEN table
-        PROPS {
-            "name": "string",
-            "database_name": "string",
-            "schema_name": "string",
-            "kind": "string",
-            "columns" : "map",
-            "comment": "string",
-            "cluster_by": "string",
-            "rows": "int",
-            "bytes": "int",
-            "owner": "string",
-            "retention_time": "string",
-            "automatic_clustering": "string",
-            "change_tracking": "string",
-            "search_optimization": "string",
-            "search_optimization_progress": "int",
-            "search_optimization_bytes":"int",
-            "is_external": "string",
-            "enable_schema_evolution": "string",
-            "owner_role_type": "string",
-            "is_event": "string",
-            "budget": "string",
-            "is_hybrid": "string",
-            "is_iceberg": "string",
-            "is_dynamic": "string",
-            "is_immutable": "string"
-        }
-        """
-        _ = execute_timed_query(conn=conn, query=init_query, database_system=database_system)
-
-    for i in range(start_idx, num_objects.value):
-        if database_system in OPENDIC_EXPS:
-            # discussion: Create table query from snowflake show tables + snowflake describe table
-            # primary key information would best be put in the columns map. Requires support for nested lists/maps so we can represent all columns individually.
-            query: str = f"""
-            CREATE OPEN table t_{i}
-            PROPS {{"name": "t_{i}",
-              "database_name": "BEETLE_DB",
-              "schema_name": "PUBLIC",
-              "kind": "TABLE",
-              "columns": {{"key": "INTEGER PRIMARY KEY", "value": "TEXT"}},
-              "comment": "",
-              "cluster_by": "",
-              "rows": 0,
-              "bytes": 0,
-              "owner": "TRAINING_ROLE",
-              "retention_time": "1",
-              "automatic_clustering": "OFF",
-              "change_tracking": "OFF",
-              "search_optimization": "OFF",
-              "search_optimization_progress": 0,
-              "search_optimization_bytes": 0,
-              "is_external": "N",
-              "enable_schema_evolution": "N",
-              "owner_role_type": "ROLE",
-              "is_event": "N",
-              "budget": "",
-              "is_hybrid": "N",
-              "is_iceberg": "N",
-              "is_dynamic": "N",
-              "is_immutable": "N"
-            }}
-            """
-        else:
-            query = f"CREATE TABLE t_{i} (id INTEGER PRIMARY KEY, value TEXT);"
-
-        start_time, end_time, query_time = execute_timed_query(conn=conn, query=query, database_system=database_system)
-        if logging:
-            record = (
-                database_system,
-                DDLCommand.CREATE,
-                query,
-                DatabaseObject.TABLE,
-                i,
-                0,
-                query_time.total_seconds(),
-                start_time,
-                end_time,
-            )
-            recorder.record(*record)
-    print()
+        _ = execute_timed_query(conn=conn, query=_OPENDIC_DEFINE_TABLE, database_system=database_system)
+
+    indices = range(start_idx, num_objects.value)
+    if concurrency > 1 and database_system in CONCURRENT_EXPS:
+        queries = list(map(_create_table_builder(database_system), indices))
+        timings = execute_timed_queries_concurrently(conn, database_system, queries, concurrency)
+    else:
+        queries = map(_create_table_builder(database_system), indices)
+        timings = None
+
+    batched = batch_size > 1 and timings is None and database_system not in OPENDIC_EXPS
+    batch: list[str] = []
+    last_idx = num_objects.value - 1
+    # Records are handed to the recorder in chunks. Loop invariants looked up once, the loop runs up to 100k times
+    records: list[tuple] = []
+    chunk_size, create, table = recorder.buffer_size, DDLCommand.CREATE, DatabaseObject.TABLE
+
+    try:
+        # Sequential runs share one cursor for the whole loop. The concurrent path keeps a cursor per query, cursors are not
+        # shared across threads. Closing its timings releases the workers and their connections as soon as the loop ends
+        with (
+            closing(timings) if timings is not None else nullcontext(),
+            open_cursor(conn, database_system) if timings is None else nullcontext() as cursor,
+        ):
+            for i, query in zip(indices, queries):
+                if timings is not None:
+                    start_time, end_time, query_time = next(timings)
+                elif batched:
+                    batch.append(query)
+                    if len(batch) < batch_size and i < last_idx:
+                        continue
+                    start_time, end_time, query_time = execute_timed_batch(conn, database_system, batch)
+                    query = "\n".join(batch)
+                    batch = []
+                else:
+                    start_time, end_time, query_time = execute_timed_query(
+                        conn=conn, query=query, database_system=database_system, cursor=cursor
+                    )
+                if logging:
+                    records.append((database_system, create, query, table, i, 0, query_time.total_seconds(), start_time, end_time))
+                    if len(records) >= chunk_size:
+                        recorder.record_many(records)
+                        records = []
+    finally:
+        # Also keeps the records of a loop that failed half way
+        recorder.record_many(records)
 
 
 def create_tables_batch(
@@ -127,141 +126,32 @@ def create_tables_batch(
     num_objects: Granularity,
     recorder: DataRecorder,
     logging=True,
+    concurrency=1,
 ):
-    print()
-    assert database_system in {DatabaseSystem.OPENDIC_POLARIS_FILE_BATCH, DatabaseSystem.OPENDIC_POLARIS_FILE_CACHED_BATCH, DatabaseSystem.OPENDIC_POLARIS_AZURE_CACHED_BATCH}
-
-    init_query: str = """
-    DEFINE OPEN table
-    PROPS {
-        "name": "string",
-        "database_name": "string",
-        "schema_name": "string",
-        "kind": "string",
-        "columns" : "map",
-        "comment": "string",
-        "cluster_by": "string",
-        "rows": "int",
-        "bytes": "int",
-        "owner": "string",
-        "retention_time": "string",
-        "automatic_clustering": "string",
-        "change_tracking": "string",
-        "search_optimization": "string",
-        "search_optimization_progress": "int",
-        "search_optimization_bytes":"int",
-        "is_external": "string",
-        "enable_schema_evolution": "string",
-        "owner_role_type": "string",
-        "is_event": "string",
-        "budget": "string",
-        "is_hybrid": "string",
-        "is_iceberg": "string",
-        "is_dynamic": "string",
-        "is_immutable": "string"
-    }
-    """
-    _ = execute_timed_query(conn=conn, query=init_query, database_system=database_system)
-
-    if num_objects.value <= 10000:
-        # Create batch job
-        query_objs = [
-            {
-                "name": f"t_{i}",
-                "database_name": "BEETLE_DB",
-                "schema_name": "PUBLIC",
-                "kind": "TABLE",
-                "columns": {"key": "INTEGER PRIMARY KEY", "value": "TEXT"},
-                "comment": "",
-                "cluster_by": "",
-                "rows": 0,
-                "bytes": 0,
-                "owner": "TRAINING_ROLE",
-                "retention_time": "1",
-                "automatic_clustering": "OFF",
-                "change_tracking": "OFF",
-                "search_optimization": "OFF",
-                "search_optimization_progress": 0,
-                "search_optimization_bytes": 0,
-                "is_external": "N",
-                "enable_schema_evolution": "N",
-                "owner_role_type": "ROLE",
-                "is_event": "N",
-                "budget": "",
-                "is_hybrid": "N",
-                "is_iceberg": "N",
-                "is_dynamic": "N",
-                "is_immutable": "N",
-            }
-            for i in range(num_objects.value)
-        ]
-
-        complete_query: str = f"""
-        CREATE OPEN BATCH table
-        OBJECTS {json.dumps(query_objs)}
-        """
+    """Create the tables with CREATE OPEN BATCH requests of at most 10,000 tables, one record per request.
+    With concurrency > 1 up to that many requests are in flight at once"""
+    assert database_system in OPENDIC_BATCH_EXPS
+
+    _ = execute_timed_query(conn=conn, query=_OPENDIC_DEFINE_TABLE, database_system=database_system)
+
+    # Split large batches into requests of at most 10,000 tables
+    ranges = [(first, min(first + 10_000, num_objects.value) - 1) for first in range(0, num_objects.value, 10_000)]
+    queries = (
+        "CREATE OPEN BATCH table OBJECTS [" + ",".join([table_props_json(i) for i in range(first, last + 1)]) + "]"
+        for first, last in ranges
+    )
+    if concurrency > 1:
+        timings = execute_timed_queries_concurrently(conn, database_system, queries, concurrency)
+    else:
+        timings = (execute_timed_query(conn=conn, query=query, database_system=database_system) for query in queries)
 
-        start_time, end_time, query_time = execute_timed_query(conn=conn, query=complete_query, database_system=database_system)
-        if logging:
-            record = (
-                database_system,
-                DDLCommand.CREATE,
-                f"CREATE OPEN BATCH table OBJECTS {json.dumps(query_objs)[-1]}",
-                DatabaseObject.TABLE,
-                num_objects.value,
-                0,
-                query_time.total_seconds(),
-                start_time,
-                end_time,
-            )
-            recorder.record(*record)
-        print()
-
-    else:  # Split large batch.
-        for i in range(num_objects.value // 10_000):
-            query_objs_batch = [
-                {
-                    "name": f"t_{j}",
-                    "database_name": "BEETLE_DB",
-                    "schema_name": "PUBLIC",
-                    "kind": "TABLE",
-                    "columns": {"key": "INTEGER PRIMARY KEY", "value": "TEXT"},
-                    "comment": "",
-                    "cluster_by": "",
-                    "rows": 0,
-                    "bytes": 0,
-                    "owner": "TRAINING_ROLE",
-                    "retention_time": "1",
-                    "automatic_clustering": "OFF",
-                    "change_tracking": "OFF",
-                    "search_optimization": "OFF",
-                    "search_optimization_progress": 0,
-                    "search_optimization_bytes": 0,
-                    "is_external": "N",
-                    "enable_schema_evolution": "N",
-                    "owner_role_type": "ROLE",
-                    "is_event": "N",
-                    "budget": "",
-                    "is_hybrid": "N",
-                    "is_iceberg": "N",
-                    "is_dynamic": "N",
-                    "is_immutable": "N",
-                }
-                for j in range(i * 10_000, min((i + 1) * 10_000, num_objects.value))
-            ]
-            complete_query_batch: str = f"""
-            CREATE OPEN BATCH table
-            OBJECTS {json.dumps(query_objs_batch)}
-            """
-
-            start_time, end_time, query_time = execute_timed_query(
-                conn=conn, query=complete_query_batch, database_system=database_system
-            )
+    with closing(timings):
+        for (first, last), (start_time, end_time, query_time) in zip(ranges, timings):
             if logging:
                 record = (
                     database_system,
                     DDLCommand.CREATE,
-                    f"CREATE OPEN BATCH table OBJECTS {json.dumps(query_objs_batch)[-1]}",
+                    f"CREATE OPEN BATCH table OBJECTS [t_{first} .. t_{last}]",
                     DatabaseObject.TABLE,
                     num_objects.value,
                     0,
@@ -270,7 +160,6 @@ def create_tables_batch(
                     end_time,
                 )
                 recorder.record(*record)
-            print()
 
 
 def alter_tables(
@@ -279,42 +168,14 @@ def alter_tables(
     granularity: Granularity,
     recorder: DataRecorder,
     num_exp,
+    table_num=None,
 ):
-    """Example: alter table t_0 add column a. Point query"""
-    print()
-    table_num = random.randint(0, granularity.value - 1)  # In case of prefetching
+    """Example: alter table t_0 add column a. Point query on table `table_num`, or a random one if not given"""
+    if table_num is None:
+        table_num = random.randrange(granularity.value)  # In case of prefetching
     if database_system in OPENDIC_EXPS:
-        props = {
-            "name": f"t_{table_num}",
-            "database_name": "BEETLE_DB",
-            "schema_name": "PUBLIC",
-            "kind": "TABLE",
-            "columns": {"key": "INTEGER PRIMARY KEY", "value": "TEXT", f"altered_{num_exp}": "TEXT"},
-            "comment": "",
-            "cluster_by": "",
-            "rows": 0,
-            "bytes": 0,
-            "owner": "TRAINING_ROLE",
-            "retention_time": "1",
-            "automatic_clustering": "OFF",
-            "change_tracking": "OFF",
-            "search_optimization": "OFF",
-            "search_optimization_progress": 0,
-            "search_optimization_bytes": 0,
-            "is_external": "N",
-            "enable_schema_evolution": "N",
-            "owner_role_type": "ROLE",
-            "is_event": "N",
-            "budget": "",
-            "is_hybrid": "N",
-            "is_iceberg": "N",
-            "is_dynamic": "N",
-            "is_immutable": "N",
-        }
-        alter_query = f"""
-        ALTER OPEN table t_{table_num}
-        PROPS {json.dumps(props)}
-        """
+        props = table_props(table_num, columns={"key": "INTEGER PRIMARY KEY", "value": "TEXT", f"altered_{num_exp}": "TEXT"})
+        alter_query = f"ALTER OPEN table t_{table_num} PROPS {dumps(props)}"
 
     else:
         alter_query = f"ALTER TABLE t_{table_num} ADD COLUMN altered_{num_exp} TEXT;"
@@ -341,47 +202,25 @@ def comment_object(
     granularity: Granularity,
     recorder: DataRecorder,
     num_exp: int,
+    object_num=None,
 ):
     """Example if comment supported: alter table t1 set comment = 'This table has been altered'\n
-    Example if comment not supported: alter table t1 rename to t1_altered"""
+    Example if comment not supported: alter table t1 rename to t1_altered\n
+    Comments object `object_num`, or a random one if not given"""
 
-    object_num = random.randint(0, granularity.value - 1)
+    if object_num is None:
+        object_num = random.randrange(granularity.value)
     if database_system == DatabaseSystem.SQLITE and database_object.value == "table":
         # ALTER column name
         comment_query = f"ALTER {database_object.value} t_{object_num} RENAME COLUMN value TO value_altered;"
 
     elif database_system in OPENDIC_EXPS:
-        props = {
-            "name": f"t_{object_num}",
-            "database_name": "BEETLE_DB",
-            "schema_name": "PUBLIC",
-            "kind": "TABLE",
-            "columns": {"key": "INTEGER PRIMARY KEY", "value": "TEXT", f"altered_{num_exp}": "TEXT"},
-            "comment": "This {database_object.value} has been altered",
-            "cluster_by": "",
-            "rows": 0,
-            "bytes": 0,
-            "owner": "TRAINING_ROLE",
-            "retention_time": "1",
-            "automatic_clustering": "OFF",
-            "change_tracking": "OFF",
-            "search_optimization": "OFF",
-            "search_optimization_progress": 0,
-            "search_optimization_bytes": 0,
-            "is_external": "N",
-            "enable_schema_evolution": "N",
-            "owner_role_type": "ROLE",
-            "is_event": "N",
-            "budget": "",
-            "is_hybrid": "N",
-            "is_iceberg": "N",
-            "is_dynamic": "N",
-            "is_immutable": "N",
-        }
-        comment_query = f"""
-        ALTER OPEN table t_{object_num}
-        PROPS {json.dumps(props)}
-        """
+        props = table_props(
+            object_num,
+            columns={"key": "INTEGER PRIMARY KEY", "value": "TEXT", f"altered_{num_exp}": "TEXT"},
+            comment="This {database_object.value} has been altered",
+        )
+        comment_query = f"ALTER OPEN table t_{object_num} PROPS {dumps(props)}"
     else:
         comment_query = f"COMMENT ON {database_object.value} t_{object_num} is 'This {database_object.value} has been altered';"
 
@@ -405,6 +244,17 @@ def comment_object(
         execute_timed_query(conn=conn, query=clean_query, database_system=database_system)
 
 
+# No trailing semicolon, so it can also be used as a prepared statement
+_POSTGRES_SHOW_TABLES = """
+        SELECT n.nspname AS schema_name,
+       c.relname AS table_name
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r'  -- 'r' indicates a regular table
+        AND n.nspname NOT IN ('pg_catalog', 'information_schema') -- Exclude system schemas
+        """
+
+
 def show_objects(
     conn: Connection | DuckDBPyConnection | connection | SnowflakeConnection | OpenDicSnowflakeCatalog,
     database_system: DatabaseSystem,
@@ -412,19 +262,16 @@ def show_objects(
     granularity: Granularity,
     recorder: DataRecorder,
     num_exp,
+    prepared=False,
 ):
-    """Example: show tables"""
+    """Example: show tables.
+    With prepared=True Postgres plans the catalog query once per connection and each SHOW only runs EXECUTE."""
     if database_system == DatabaseSystem.SQLITE:
         query = f"""SELECT name FROM sqlite_master WHERE type = '{database_object.value}';"""
+    elif database_system == DatabaseSystem.POSTGRES and prepared:
+        query = prepare_postgres_statement(conn, "show_tables", _POSTGRES_SHOW_TABLES)
     elif database_system == DatabaseSystem.POSTGRES:
-        query = """
-        SELECT n.nspname AS schema_name,
-       c.relname AS table_name
-        FROM pg_catalog.pg_class c
-        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-        WHERE c.relkind = 'r'  -- 'r' indicates a regular table
-        AND n.nspname NOT IN ('pg_catalog', 'information_schema'); -- Exclude system schemas
-        """
+        query = _POSTGRES_SHOW_TABLES
     elif database_system == DatabaseSystem.SNOWFLAKE:
         query = "show tables limit 10000"
     elif database_system in OPENDIC_EXPS:
@@ -444,4 +291,3 @@ def show_objects(
         end_time,
     )
     recorder.record(*record)
-    print()
@@ -2,37 +2,96 @@
 Data recorder. Handle recording of results and experiment metadata.
 """
 
+import atexit
+import queue
+import threading
+from collections.abc import Iterable
 from datetime import datetime
 
 import duckdb
+from pandas import DataFrame
+
+try:
+    import pyarrow
+except ImportError:  # Optional. Fall back to a pandas frame
+    pyarrow = None
 
 from opendic_benchmark.consts import DatabaseObject, DatabaseSystem, DDLCommand, Granularity
 
+# Single log table for all systems. Each system also gets a view named after it
+LOG_TABLE = "experiment_logs"
+
+# Column order of the log table, matches the record tuples
+_COLUMNS = [
+    "system_name",
+    "ddl_command",
+    "query_text",
+    "target_object",
+    "granularity",
+    "repetition_nr",
+    "query_runtime",
+    "start_time",
+    "end_time",
+]
+
+# Tells the background writer to stop
+_STOP = object()
+
 
 class DataRecorder:
-    def __init__(self, db_name="experiment_logs.db"):
+    """Log experiment records to DuckDB.
+    With background=True record() only enqueues, and a writer thread buffers and appends the records to DuckDB, so even
+    the bulk writes happen off the experiment thread."""
+
+    def __init__(self, db_name="experiment_logs.db", buffer_size=4096, background=False):
         self.db_name: str = db_name
         self.conn = duckdb.connect(self.db_name)
+        # Records are buffered and written in bulk, so the inserts stay out of the experiment loops
+        self.buffer_size: int = buffer_size
+        self._buffer: list[tuple] = []
+        # The DuckDB connection and buffer are shared, so experiments may record from several threads
+        self._lock = threading.Lock()
+        self._queue: queue.Queue | None = None
+        self._writer: threading.Thread | None = None
+        # Set if the writer thread fails. Raised again on the experiment thread by the next record() or flush()
+        self._writer_error: Exception | None = None
+        # Write the buffered records even if the experiment exits without calling close()
+        atexit.register(self.close)
 
-        # Initialize tables for all systems when we init
+        # Initialize the log table when we init
         self._initialize_tables()
 
+        if background:
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._drain, name="DataRecorder-writer", daemon=True)
+            self._writer.start()
+
     def _initialize_tables(self):
-        # Create a table for each system if it doesn't exist - no need to check if it exists when we record
+        # All systems log to one table, keyed by system_name - no need to check if it exists when we record
+        create_table_query = f"""CREATE TABLE IF NOT EXISTS {LOG_TABLE}(
+            system_name VARCHAR,
+            ddl_command VARCHAR,
+            query_text VARCHAR,
+            target_object VARCHAR,
+            granularity INTEGER,
+            repetition_nr INTEGER,
+            query_runtime DOUBLE,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+        );"""
+        self.conn.sql(create_table_query)
+
+        existing_tables = {name.lower() for (name,) in self.conn.sql("SELECT table_name FROM duckdb_tables()").fetchall()}
         for system in DatabaseSystem:
-            table_name = f"{system.value}"  # So we get sqlite_experiment_logs, postgres_sqlite_experiment_logs_logs, etc.
-            create_table_query = f"""CREATE TABLE IF NOT EXISTS {table_name}(
-                system_name VARCHAR,
-                ddl_command VARCHAR,
-                query_text VARCHAR,
-                target_object VARCHAR,
-                granularity INTEGER,
-                repetition_nr INTEGER,
-                query_runtime DOUBLE,
-                start_time TIMESTAMP,
-                end_time TIMESTAMP,
-            );"""
-            self.conn.sql(create_table_query)
+            view_name = system.value
+            if view_name.lower() in existing_tables:
+                # Log file from before the single log table. Move the old per-system rows over
+                self.conn.sql(f'INSERT INTO {LOG_TABLE} SELECT * FROM "{view_name}"')
+                self.conn.sql(f'DROP TABLE "{view_name}"')
+            # Keep one view per system (sqlite, postgres, duckDB, ...), so per-system queries and exports still work
+            self.conn.sql(
+                f"""CREATE OR REPLACE VIEW "{view_name}" AS SELECT * FROM {LOG_TABLE} WHERE system_name = '{view_name}'"""
+            )
 
     def record(
         self,
@@ -46,13 +105,46 @@ class DataRecorder:
         start_time: datetime,
         end_time: datetime,
     ):
-        table_name = f"{system.value}"  # Dyn table name based on system enum
-        insert_query = f"""
-            INSERT INTO {table_name}(system_name,ddl_command,query_text,target_object,granularity,repetition_nr,query_runtime,start_time,end_time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
-        """
-        # Execute the insert query
-        record = (
+        record = self._row(
+            system, ddl_command, query_text, target_object, granularity, repetition_nr, query_runtime, start_time, end_time
+        )
+
+        if self._queue is not None:
+            self._raise_writer_error()
+            self._queue.put(record)
+            return
+
+        self._buffer_record(record)
+
+    def record_many(self, records: Iterable[tuple]):
+        """Record several results at once. Each item holds the arguments of record(), in the same order"""
+        rows = [self._row(*record) for record in records]
+
+        if self._queue is not None:
+            self._raise_writer_error()
+            for row in rows:
+                self._queue.put(row)
+            return
+
+        with self._lock:
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    @staticmethod
+    def _row(
+        system: DatabaseSystem,
+        ddl_command: DDLCommand,
+        query_text: str,
+        target_object: DatabaseObject,
+        granularity: Granularity | int,
+        repetition_nr: int,
+        query_runtime: float,
+        start_time: datetime,
+        end_time: datetime,
+    ) -> tuple:
+        """Log table row for a record, in _COLUMNS order"""
+        return (
             system.value,
             ddl_command.value,
             query_text,
@@ -64,10 +156,90 @@ class DataRecorder:
             end_time,
         )
 
-        self.conn.execute(insert_query, record)
+    def _buffer_record(self, record: tuple):
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def _drain(self):
+        """Background writer loop. Moves queued records into the buffer until _STOP, or until a write fails"""
+        while True:
+            record = self._queue.get()
+            try:
+                if record is _STOP:
+                    return
+                self._buffer_record(record)
+            except Exception as e:
+                self._writer_error = e
+                return
+            finally:
+                self._queue.task_done()
+
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            raise self._writer_error
+
+    def _wait_for_writer(self) -> bool:
+        """Wait until the writer took every queued record. False if the writer died first, then the rest stays queued"""
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if self._writer is None or not self._writer.is_alive():
+                    return False
+                self._queue.all_tasks_done.wait(timeout=0.1)
+        return True
+
+    def _drain_queue(self):
+        """Move the queued records into the buffer on the calling thread. For when there is no live writer"""
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if record is not _STOP:
+                    with self._lock:
+                        self._buffer.append(record)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Write all buffered records. Raises the error of a failed background writer"""
+        if self._queue is not None and not self._wait_for_writer():
+            self._drain_queue()
+        with self._lock:
+            self._flush()
+        self._raise_writer_error()
+
+    def _flush(self):
+        """Write the buffered records. Caller must hold the lock"""
+        if not self._buffer:
+            return
+        # Bulk insert a columnar table. Much faster than a parametrized INSERT per row
+        if pyarrow is not None:
+            # Transposing to column lists and building an Arrow table is about twice as fast as a pandas frame of tuples
+            columns = dict(zip(_COLUMNS, map(list, zip(*self._buffer))))
+            self.conn.from_arrow(pyarrow.Table.from_pydict(columns)).insert_into(LOG_TABLE)
+        else:
+            self.conn.append(LOG_TABLE, DataFrame(self._buffer, columns=_COLUMNS))
+        self._buffer.clear()
 
     def close(self):
-        self.conn.close()
+        if self.conn is None:  # Already closed
+            return
+        if self._writer is not None:
+            if self._writer.is_alive():
+                self._queue.put(_STOP)
+                self._writer.join()
+            self._writer = None
+        try:
+            self.flush()
+        finally:
+            # Close even if the last write failed, the error still reaches the caller
+            with self._lock:
+                self.conn.close()
+                self.conn = None
+            atexit.unregister(self.close)
 
 
 # Example
@@ -89,12 +261,13 @@ if __name__ == "__main__":
         ),
     ]
 
-    # Record each experiment in the respective system table
+    # Record each experiment in the log table
     for experiment in experiments:
         # The * operator unpacks the tuple into each attribute for the record method
         db_recorder.record(*experiment)
+    db_recorder.close()
 
     db_file = "experiment_logs.db"
     with duckdb.connect(db_file) as conn:
-        conn.table(f"{DatabaseSystem.SQLITE.value}db_logs").show()
-        conn.sql(f"drop table {DatabaseSystem.SQLITE.value}db_logs")
+        conn.table(DatabaseSystem.SQLITE.value).show()
+        conn.sql(f"DELETE FROM {LOG_TABLE} WHERE query_text = 'CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT);'")
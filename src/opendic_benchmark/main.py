@@ -5,7 +5,11 @@ Main experiment file. Run experiment for all data systems (Sqlite, Postgresql, d
 import argparse
 import logging
 import os
+import random
 import sqlite3
+from collections.abc import Callable, Iterator
+from functools import partial
+from typing import Any
 
 import duckdb
 import psycopg2
@@ -13,6 +17,7 @@ import snowflake.connector
 from snowflake_opendic.catalog import OpenDicSnowflakeCatalog
 
 from opendic_benchmark.consts import (
+    CONCURRENT_EXPS,
     OPENDIC_EXPS,
     DatabaseObject,
     DatabaseSystem,
@@ -26,7 +31,13 @@ from opendic_benchmark.exp_function import (
 )
 from opendic_benchmark.exp_table import alter_tables, comment_object, create_tables, create_tables_batch, show_objects
 from opendic_benchmark.experiment_logger.data_recorder import DataRecorder
-from opendic_benchmark.runner import close_database, connect_opendict, connect_standard_database, execute_timed_query
+from opendic_benchmark.runner import (
+    calibrate_timer_overhead,
+    close_database,
+    connect_opendict,
+    connect_standard_database,
+    execute_timed_query,
+)
 
 # Configure logging
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -41,8 +52,7 @@ def drop_schema(
     database_system: DatabaseSystem,
     database_object: DatabaseObject = DatabaseObject.TABLE,
 ):
-    """Example: drop schema/db"""
-    # switch case:
+    """Example: drop schema/db. Runs on the experiment's open connection"""
     drop_query: str = "None"
     try:
         if database_system == DatabaseSystem.SQLITE:
@@ -50,15 +60,18 @@ def drop_schema(
                 os.remove("sqlite.db")
             else:
                 logging.info("No database file found")
-
-        if database_system == DatabaseSystem.DUCKDB:
+            for wal_file in ("sqlite.db-wal", "sqlite.db-shm"):  # Left behind by --tuned-sqlite runs
+                if os.path.exists(wal_file):
+                    os.remove(wal_file)
+        elif database_system == DatabaseSystem.DUCKDB:
             drop_query = "DROP SCHEMA experiment CASCADE;"
-        if database_system == DatabaseSystem.POSTGRES:
+        elif database_system == DatabaseSystem.POSTGRES:
+            # One round trip, psycopg2 sends both statements in a single execute
             drop_query = """DROP SCHEMA public CASCADE;
                             CREATE SCHEMA public;"""
-        if database_system == DatabaseSystem.SNOWFLAKE:
+        elif database_system == DatabaseSystem.SNOWFLAKE:
             drop_query = "DROP SCHEMA metadata_experiment CASCADE;"
-        if database_system in OPENDIC_EXPS:
+        elif database_system in OPENDIC_EXPS:
             drop_query = f"DROP OPEN {database_object.value}"
 
         logging.info(f"Dropping: {database_system}")
@@ -70,88 +83,170 @@ def drop_schema(
         logging.error(f"Drop schema failed: {e}")
 
 
-def experiment_standard_table(recorder: DataRecorder, database_system: DatabaseSystem, start_idx=0):
+def experiment_connections(database_system: DatabaseSystem, connect: Callable) -> Iterator[tuple[Granularity, Any]]:
+    """Yield every granularity together with the connection to run it on. The connection is opened once and reused
+    across granularities, except for SQLite: drop_schema deletes its database file, so each granularity reconnects"""
+    conn = connect()
+    try:
+        for i, gran in enumerate(Granularity):
+            if i and database_system == DatabaseSystem.SQLITE:
+                close_database(database_system, conn)
+                conn = connect()
+            yield gran, conn
+    finally:
+        close_database(database_system, conn)
+
+
+def experiment_standard_table(
+    recorder: DataRecorder,
+    database_system: DatabaseSystem,
+    start_idx=0,
+    batch_size=1,
+    concurrency=1,
+    tuned_sqlite=False,
+    duckdb_memory=False,
+    prepared_show=False,
+):
     try:
         logging.info("Starting experiment 1!")
 
-        for gran in Granularity:
+        connect = partial(connect_standard_database, database_system, tuned_sqlite, duckdb_memory)
+        for gran, conn in experiment_connections(database_system, connect):
             logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: started")
-            with connect_standard_database(database_system=database_system) as conn:
-                logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: connected")
-                create_tables(conn=conn, database_system=database_system, num_objects=gran, recorder=recorder)
-                for num_exp in range(3):
-                    alter_tables(conn=conn, database_system=database_system, granularity=gran, num_exp=num_exp, recorder=recorder)
-                    print()
-                    comment_object(
-                        conn=conn,
-                        database_system=database_system,
-                        database_object=DatabaseObject.TABLE,
-                        granularity=gran,
-                        recorder=recorder,
-                        num_exp=num_exp,
-                    )
-                    print()
-                    show_objects(
-                        conn=conn,
-                        database_system=database_system,
-                        database_object=DatabaseObject.TABLE,
-                        granularity=gran,
-                        num_exp=num_exp,
-                        recorder=recorder,
-                    )
-                logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: SUCCESSFUL")
-                drop_schema(conn=conn, database_system=database_system)
+            logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: connected")
+            create_tables(
+                conn=conn,
+                database_system=database_system,
+                num_objects=gran,
+                recorder=recorder,
+                concurrency=concurrency,
+                batch_size=batch_size,
+            )
+            # Draw the target tables up front, so no RNG call sits between the timed queries
+            alter_idxs = random.choices(range(gran.value), k=3)
+            comment_idxs = random.choices(range(gran.value), k=3)
+            for num_exp in range(3):
+                alter_tables(
+                    conn=conn,
+                    database_system=database_system,
+                    granularity=gran,
+                    num_exp=num_exp,
+                    recorder=recorder,
+                    table_num=alter_idxs[num_exp],
+                )
+                comment_object(
+                    conn=conn,
+                    database_system=database_system,
+                    database_object=DatabaseObject.TABLE,
+                    granularity=gran,
+                    recorder=recorder,
+                    num_exp=num_exp,
+                    object_num=comment_idxs[num_exp],
+                )
+                show_objects(
+                    conn=conn,
+                    database_system=database_system,
+                    database_object=DatabaseObject.TABLE,
+                    granularity=gran,
+                    num_exp=num_exp,
+                    recorder=recorder,
+                    prepared=prepared_show,
+                )
+            logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: SUCCESSFUL")
+            drop_schema(conn=conn, database_system=database_system)
     except Exception as e:
         logging.error(f"Experiment 1 failed: {e}")
     finally:
         logging.info("Experiment 1 finished.")
 
 
-def experiment_standard_function(recorder: DataRecorder, database_system: DatabaseSystem, start_idx=0):
+def experiment_standard_function(
+    recorder: DataRecorder,
+    database_system: DatabaseSystem,
+    start_idx=0,
+    batch_size=1,
+    concurrency=1,
+    prepared_show=False,
+    duckdb_memory=False,
+):
     try:
         logging.info("Starting function experiment!")
 
-        for gran in Granularity:
+        connect = partial(connect_standard_database, database_system, duckdb_memory=duckdb_memory)
+        for gran, conn in experiment_connections(database_system, connect):
             logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: started")
-            with connect_standard_database(database_system=database_system) as conn:
-                logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: connected")
-                run_create_function(
-                    conn=conn, database_system=database_system, granularity=gran, recorder=recorder, start_idx=start_idx
+            logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: connected")
+            run_create_function(
+                conn=conn,
+                database_system=database_system,
+                granularity=gran,
+                recorder=recorder,
+                start_idx=start_idx,
+                batch_size=batch_size,
+                concurrency=concurrency,
+            )
+
+            # Draw the target functions up front, so no RNG call sits between the timed queries
+            alter_idxs = random.choices(range(gran.value), k=3)
+            comment_idxs = random.choices(range(gran.value), k=3)
+            for num_exp in range(3):
+                # ALTER
+                run_alter_function(
+                    conn=conn,
+                    database_system=database_system,
+                    granularity=gran,
+                    recorder=recorder,
+                    num_exp=num_exp,
+                    idx=alter_idxs[num_exp],
                 )
 
-                for num_exp in range(3):
-                    # ALTER
-                    run_alter_function(
-                        conn=conn, database_system=database_system, granularity=gran, recorder=recorder, num_exp=num_exp
-                    )
-
-                    # COMMENT
-                    run_comment_function(
-                        conn=conn, database_system=database_system, granularity=gran, recorder=recorder, num_exp=num_exp
-                    )
+                # COMMENT
+                run_comment_function(
+                    conn=conn,
+                    database_system=database_system,
+                    granularity=gran,
+                    recorder=recorder,
+                    num_exp=num_exp,
+                    idx=comment_idxs[num_exp],
+                )
 
-                    # SHOW
-                    run_show_functions(
-                        conn=conn, database_system=database_system, granularity=gran, recorder=recorder, num_exp=num_exp
-                    )
+                # SHOW
+                run_show_functions(
+                    conn=conn,
+                    database_system=database_system,
+                    granularity=gran,
+                    recorder=recorder,
+                    num_exp=num_exp,
+                    prepared=prepared_show,
+                )
 
-                logging.info(f"Function Experiment | Granularity: {gran.value} | Status: SUCCESSFUL")
-                drop_schema(conn=conn, database_system=database_system, database_object=DatabaseObject.FUNCTION)
+            logging.info(f"Function Experiment | Granularity: {gran.value} | Status: SUCCESSFUL")
+            drop_schema(conn=conn, database_system=database_system, database_object=DatabaseObject.FUNCTION)
     except Exception as e:
         logging.error(f"Function experiment failed: {e}")
     finally:
         logging.info("Function experiment finished.")
 
 
-def experiment_opendic_table(recorder: DataRecorder, database_system: DatabaseSystem, start_idx=0):
+def experiment_opendic_table(recorder: DataRecorder, database_system: DatabaseSystem, start_idx=0, concurrency=1):
     try:
         logging.info("Starting experiment 1!")
 
-        for gran in Granularity:
+        connect = partial(connect_opendict, pool_maxsize=max(16, concurrency))
+        for gran, conn in experiment_connections(database_system, connect):
             logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: started")
-            conn = connect_opendict()
             logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: connected")
-            create_tables(conn=conn, database_system=database_system, num_objects=gran, recorder=recorder, start_idx=start_idx)
+            create_tables(
+                conn=conn,
+                database_system=database_system,
+                num_objects=gran,
+                recorder=recorder,
+                start_idx=start_idx,
+                concurrency=concurrency,
+            )
+            # Draw the target tables up front, so no RNG call sits between the timed queries
+            alter_idxs = random.choices(range(gran.value), k=3)
+            comment_idxs = random.choices(range(gran.value), k=3)
             for num_exp in range(3):
                 alter_tables(
                     conn=conn,
@@ -159,6 +254,7 @@ def experiment_opendic_table(recorder: DataRecorder, database_system: DatabaseSy
                     granularity=gran,
                     recorder=recorder,
                     num_exp=num_exp,
+                    table_num=alter_idxs[num_exp],
                 )
                 comment_object(
                     conn=conn,
@@ -167,6 +263,7 @@ def experiment_opendic_table(recorder: DataRecorder, database_system: DatabaseSy
                     granularity=gran,
                     recorder=recorder,
                     num_exp=num_exp,
+                    object_num=comment_idxs[num_exp],
                 )
                 show_objects(
                     conn=conn,
@@ -184,27 +281,42 @@ def experiment_opendic_table(recorder: DataRecorder, database_system: DatabaseSy
         logging.info("Experiment 1 finished.")
 
 
-def experiment_opendic_function(recorder: DataRecorder, database_system: DatabaseSystem):
+def experiment_opendic_function(recorder: DataRecorder, database_system: DatabaseSystem, concurrency=1):
     try:
         logging.info("Starting function experiment!")
 
-        for gran in Granularity:
+        connect = partial(connect_opendict, pool_maxsize=max(16, concurrency))
+        for gran, conn in experiment_connections(database_system, connect):
             logging.info(f"Function Experiment | Granularity: {gran.value} | Status: started")
-            conn = connect_opendict()
             logging.info(f"Function Experiment | Granularity: {gran.value} | Status: connected")
 
             # CREATE functions
-            run_create_function(conn=conn, database_system=database_system, granularity=gran, recorder=recorder)
+            run_create_function(
+                conn=conn, database_system=database_system, granularity=gran, recorder=recorder, concurrency=concurrency
+            )
 
+            # Draw the target functions up front, so no RNG call sits between the timed queries
+            alter_idxs = random.choices(range(gran.value), k=3)
+            comment_idxs = random.choices(range(gran.value), k=3)
             for num_exp in range(3):
                 # ALTER
                 run_alter_function(
-                    conn=conn, database_system=database_system, granularity=gran, recorder=recorder, num_exp=num_exp
+                    conn=conn,
+                    database_system=database_system,
+                    granularity=gran,
+                    recorder=recorder,
+                    num_exp=num_exp,
+                    idx=alter_idxs[num_exp],
                 )
 
                 # COMMENT
                 run_comment_function(
-                    conn=conn, database_system=database_system, granularity=gran, recorder=recorder, num_exp=num_exp
+                    conn=conn,
+                    database_system=database_system,
+                    granularity=gran,
+                    recorder=recorder,
+                    num_exp=num_exp,
+                    idx=comment_idxs[num_exp],
                 )
 
                 # SHOW
@@ -220,15 +332,20 @@ def experiment_opendic_function(recorder: DataRecorder, database_system: Databas
         logging.info("Function experiment finished.")
 
 
-def experiment_opendic_table_batch(recorder: DataRecorder, database_system: DatabaseSystem):
+def experiment_opendic_table_batch(recorder: DataRecorder, database_system: DatabaseSystem, concurrency=1):
     try:
         logging.info("Starting experiment 1!")
 
-        for gran in Granularity:
+        connect = partial(connect_opendict, pool_maxsize=max(16, concurrency))
+        for gran, conn in experiment_connections(database_system, connect):
             logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: started")
-            conn = connect_opendict()
             logging.info(f"Experiment: 1 | Object: {DatabaseObject.TABLE} | Granularity: {gran.value} | Status: connected")
-            create_tables_batch(conn=conn, database_system=database_system, num_objects=gran, recorder=recorder)
+            create_tables_batch(
+                conn=conn, database_system=database_system, num_objects=gran, recorder=recorder, concurrency=concurrency
+            )
+            # Draw the target tables up front, so no RNG call sits between the timed queries
+            alter_idxs = random.choices(range(gran.value), k=3)
+            comment_idxs = random.choices(range(gran.value), k=3)
             for num_exp in range(3):
                 alter_tables(
                     conn=conn,
@@ -236,6 +353,7 @@ def experiment_opendic_table_batch(recorder: DataRecorder, database_system: Data
                     granularity=gran,
                     recorder=recorder,
                     num_exp=num_exp,
+                    table_num=alter_idxs[num_exp],
                 )
                 comment_object(
                     conn=conn,
@@ -244,6 +362,7 @@ def experiment_opendic_table_batch(recorder: DataRecorder, database_system: Data
                     granularity=gran,
                     recorder=recorder,
                     num_exp=num_exp,
+                    object_num=comment_idxs[num_exp],
                 )
                 show_objects(
                     conn=conn,
@@ -289,8 +408,56 @@ def main():
         choices=["standard_table", "opendic_table", "standard_function", "opendic_function", "opendic_table_batch"],
         help="Which experiment to run",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of CREATE statements sent per round trip in the standard experiments (1 = one statement per query)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of CREATE statements or batch requests in flight at once (postgres, snowflake and opendic only)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for picking the objects to ALTER and COMMENT, for reproducible runs (default: unseeded)",
+    )
+    parser.add_argument(
+        "--background-recorder",
+        action="store_true",
+        help="Write the result records from a background thread instead of between the timed queries",
+    )
+    parser.add_argument(
+        "--tuned-sqlite",
+        action="store_true",
+        help="Run standard_table on SQLite with WAL, synchronous=NORMAL and an in-memory temp store (not comparable to default runs)",
+    )
+    parser.add_argument(
+        "--duckdb-memory",
+        action="store_true",
+        help="Run the standard experiments on an in-memory DuckDB instead of duckdb.db (not comparable to default runs)",
+    )
+    parser.add_argument(
+        "--subtract-timer-overhead",
+        action="store_true",
+        help="Calibrate the cost of the timer calls at startup and subtract it from every recorded query time",
+    )
+    parser.add_argument(
+        "--prepared-show",
+        action="store_true",
+        help="Run the repeated SHOW query of the standard experiments as a server-side prepared statement (postgres only)",
+    )
 
     args = parser.parse_args()
+    random.seed(args.seed)
+    if args.subtract_timer_overhead:
+        logging.info(f"Timer overhead: {calibrate_timer_overhead()} ns, subtracted from every query time")
+    if args.batch_size > 1 and args.concurrency > 1:
+        parser.error("--batch-size and --concurrency cannot be combined")
 
     # Map command line argument to DatabaseSystem enum
     db_system_map: dict[str, DatabaseSystem] = {
@@ -307,6 +474,9 @@ def main():
     }
 
     database_system: DatabaseSystem = db_system_map[args.db]
+    if args.concurrency > 1 and database_system not in CONCURRENT_EXPS:
+        # A serial run would be recorded as if it were concurrent
+        parser.error(f"--concurrency is not supported for {args.db}")
 
     if database_system == "sqlite" and args.exp == "standard_function":
         logging.info("No function support")
@@ -315,33 +485,50 @@ def main():
     # Create recorder before experiment
     if database_system in OPENDIC_EXPS:
         conn = connect_opendict()
-        recorder = DataRecorder(db_name="opendic_benchmark_logs.db")
+        recorder = DataRecorder(db_name="opendic_benchmark_logs.db", background=args.background_recorder)
     else:
         conn = connect_standard_database(database_system)
-        recorder = DataRecorder(db_name="experiment_logs.db")
+        recorder = DataRecorder(db_name="experiment_logs.db", background=args.background_recorder)
 
     try:
-        # Clean up any existing schemas first
-        drop_schema(conn=conn, database_system=database_system)
+        # Clean up any existing schemas first. The experiments open their own connection
+        try:
+            drop_schema(conn=conn, database_system=database_system)
+        finally:
+            close_database(database_system, conn)
 
         # Run the correct experiment based on the database system and args
         if args.exp == "standard_table":
-            experiment_standard_table(recorder=recorder, database_system=database_system)
+            experiment_standard_table(
+                recorder=recorder,
+                database_system=database_system,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                tuned_sqlite=args.tuned_sqlite,
+                duckdb_memory=args.duckdb_memory,
+                prepared_show=args.prepared_show,
+            )
         elif args.exp == "opendic_table":
-            experiment_opendic_table(recorder=recorder, database_system=database_system)
+            experiment_opendic_table(recorder=recorder, database_system=database_system, concurrency=args.concurrency)
         elif args.exp == "opendic_table_batch":
-            experiment_opendic_table_batch(recorder=recorder, database_system=database_system)
+            experiment_opendic_table_batch(recorder=recorder, database_system=database_system, concurrency=args.concurrency)
         elif args.exp == "standard_function":
-            experiment_standard_function(recorder=recorder, database_system=database_system)
+            experiment_standard_function(
+                recorder=recorder,
+                database_system=database_system,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                prepared_show=args.prepared_show,
+                duckdb_memory=args.duckdb_memory,
+            )
         elif args.exp == "opendic_function":
-            experiment_opendic_function(recorder=recorder, database_system=database_system)
+            experiment_opendic_function(recorder=recorder, database_system=database_system, concurrency=args.concurrency)
 
         logging.info("Done!")
 
     except Exception as e:
         logging.error(f"Error in main execution: {e}")
     finally:
-        close_database(database_system, conn)
         recorder.close()
 
 
@@ -0,0 +1,129 @@
+"""
+OpenDic PROPS payloads. Built as dicts and serialized once per query instead of hand-written JSON in f-strings.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional. Fall back to the stdlib encoder
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """Serialize a PROPS payload to JSON. Uses orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def dumps_bytes(obj) -> bytes:
+    """Serialize a request body straight to UTF-8 JSON bytes. orjson produces the bytes directly, no intermediate str"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+FUNCTION_SCHEMA = {
+    "name": "string",
+    "language": "string",
+    "args": "map",
+    "definition": "string",
+    "comment": "string",
+}
+
+
+def function_props(idx: int, definition: str = "SELECT a + b", comment: str = "") -> dict:
+    """PROPS of function f_{idx}"""
+    return {
+        "name": f"f_{idx}",
+        "language": "sql",
+        "args": {"a": "int", "b": "int"},
+        "definition": definition,
+        "comment": comment,
+    }
+
+
+# function_props(idx) serialized once, without its opening brace and name. Only the name is spliced in per function
+_FUNCTION_PROPS_JSON_TAIL = dumps({k: v for k, v in function_props(0).items() if k != "name"})[1:]
+
+
+def function_props_json(idx: int) -> str:
+    """JSON of function_props(idx) without encoding the constant fields again"""
+    return f'{{"name": "f_{idx}", {_FUNCTION_PROPS_JSON_TAIL}'
+
+
+TABLE_SCHEMA = {
+    "name": "string",
+    "database_name": "string",
+    "schema_name": "string",
+    "kind": "string",
+    "columns": "map",
+    "comment": "string",
+    "cluster_by": "string",
+    "rows": "int",
+    "bytes": "int",
+    "owner": "string",
+    "retention_time": "string",
+    "automatic_clustering": "string",
+    "change_tracking": "string",
+    "search_optimization": "string",
+    "search_optimization_progress": "int",
+    "search_optimization_bytes": "int",
+    "is_external": "string",
+    "enable_schema_evolution": "string",
+    "owner_role_type": "string",
+    "is_event": "string",
+    "budget": "string",
+    "is_hybrid": "string",
+    "is_iceberg": "string",
+    "is_dynamic": "string",
+    "is_immutable": "string",
+}
+
+# Table PROPS from snowflake show tables + snowflake describe table. Only name, columns and comment vary per table.
+# discussion: primary key information would best be put in the columns map. Requires support for nested lists/maps so we
+# can represent all columns individually.
+_TABLE_PROPS_TEMPLATE = {
+    "database_name": "BEETLE_DB",
+    "schema_name": "PUBLIC",
+    "kind": "TABLE",
+    "columns": {"key": "INTEGER PRIMARY KEY", "value": "TEXT"},
+    "comment": "",
+    "cluster_by": "",
+    "rows": 0,
+    "bytes": 0,
+    "owner": "TRAINING_ROLE",
+    "retention_time": "1",
+    "automatic_clustering": "OFF",
+    "change_tracking": "OFF",
+    "search_optimization": "OFF",
+    "search_optimization_progress": 0,
+    "search_optimization_bytes": 0,
+    "is_external": "N",
+    "enable_schema_evolution": "N",
+    "owner_role_type": "ROLE",
+    "is_event": "N",
+    "budget": "",
+    "is_hybrid": "N",
+    "is_iceberg": "N",
+    "is_dynamic": "N",
+    "is_immutable": "N",
+}
+
+
+def table_props(idx: int, columns: dict | None = None, comment: str = "") -> dict:
+    """PROPS of table t_{idx}. Copies the shared template, only the name, `columns` and `comment` are set per table"""
+    props = {"name": f"t_{idx}", **_TABLE_PROPS_TEMPLATE, "comment": comment}
+    if columns is not None:
+        props["columns"] = columns
+    return props
+
+
+# The template serialized once, without its opening brace. Only the name is spliced in per table
+_TABLE_PROPS_JSON_TAIL = dumps(_TABLE_PROPS_TEMPLATE)[1:]
+
+
+def table_props_json(idx: int) -> str:
+    """JSON of table_props(idx) without encoding the constant fields again"""
+    return f'{{"name": "t_{idx}", {_TABLE_PROPS_JSON_TAIL}'
@@ -1,44 +1,136 @@
 import datetime
+import functools
+import queue
+import socket
 import sqlite3
+import statistics
 import sys
+import threading
+import time
+import weakref
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from typing import Any
 
 import duckdb
 import psycopg2
+import requests
 import snowflake.connector
 import toml
 from pandas import DataFrame
+from requests.adapters import HTTPAdapter
 from snowflake_opendic.catalog import OpenDicSnowflakeCatalog
+from snowflake_opendic.client import OpenDicClient
 from snowflake_opendic.pretty_pesponse import PrettyResponse
-from snowflake_opendic.snow_opendic import snowflake_connect
+from urllib3.connection import HTTPConnection
 
-from opendic_benchmark.consts import OPENDIC_EXPS, DatabaseSystem
+from opendic_benchmark.consts import CONCURRENT_EXPS, OPENDIC_EXPS, DatabaseSystem
+from opendic_benchmark.opendic_props import dumps_bytes
 
 
+@functools.lru_cache
 def read_secret(secret_name: str, secrets_path: str = "/run/secrets") -> str:
-    """Get `secret_name` from docker-compose secret store"""
+    """Get `secret_name` from docker-compose secret store. Read once, later connects reuse the value"""
     filepath = f"{secrets_path}/{secret_name}"
     with open(filepath, "r") as f:
         return f.read().strip()  # Remove any trailing newline
 
 
-def connect_sqlite() -> sqlite3.Connection:
-    return sqlite3.connect("sqlite.db")
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose sockets keep urllib3's TCP_NODELAY and also enable SO_KEEPALIVE, so pooled connections survive
+    the idle gaps between experiment phases instead of being dropped by the network and re-handshaked"""
 
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
 
-def connect_duckdb() -> duckdb.DuckDBPyConnection:
-    return duckdb.connect("duckdb.db")
 
+class SessionOpenDicClient(OpenDicClient):
+    """OpenDicClient that sends every request over one keep-alive HTTP session.
+    The stock client calls `requests.post/get/...` directly, so each DDL pays a new TCP (and TLS) handshake.
+    Request bodies are encoded to JSON bytes in one step (orjson when installed) instead of requests' `json=` str + encode."""
 
-def connect_postgres(config_path: str = "secrets/postgres-conf.toml") -> psycopg2.extensions.connection:
+    def __init__(self, client: OpenDicClient, pool_maxsize: int = 16) -> None:
+        # Take over the already authenticated client. No need to fetch a new oauth token
+        self.api_url: str = client.api_url
+        self.credentials: str = client.credentials
+        self.oauth_token: str = client.oauth_token
+        self.session = requests.Session()
+        adapter = KeepAliveHTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, endpoint: str, data: dict) -> dict[str, Any]:
+        url: str = self.api_url + "/opendic/v1" + endpoint
+        response: requests.Response = self.session.post(
+            url,
+            data=dumps_bytes(data),
+            headers={"Authorization": f"Bearer {self.oauth_token}", "Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, endpoint: str):
+        url: str = self.api_url + "/opendic/v1" + endpoint
+        response: requests.Response = self.session.get(url, headers={"Authorization": f"Bearer {self.oauth_token}"})
+        response.raise_for_status()
+        return response.json()
+
+    def put(self, endpoint: str, data: dict) -> dict[str, Any]:
+        url: str = self.api_url + "/opendic/v1" + endpoint
+        response: requests.Response = self.session.put(
+            url,
+            data=dumps_bytes(data),
+            headers={"Authorization": f"Bearer {self.oauth_token}", "Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def delete(self, endpoint: str) -> dict[str, Any]:
+        url: str = self.api_url + "/opendic/v1" + endpoint
+        response: requests.Response = self.session.delete(url, headers={"Authorization": f"Bearer {self.oauth_token}"})
+        response.raise_for_status()
+        return response.json()
+
+
+# Opt-in SQLite tuning. Trades commit durability for speed, so these runs are not comparable to the default ones
+_SQLITE_TUNING_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+
+
+def connect_sqlite(tuned: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect("sqlite.db")
+    if tuned:
+        for pragma in _SQLITE_TUNING_PRAGMAS:
+            conn.execute(pragma)
+    return conn
+
+
+def connect_duckdb(in_memory: bool = False) -> duckdb.DuckDBPyConnection:
+    # In memory there is no catalog file to write on every DDL. Opt-in, the default runs measure the file-backed catalog
+    return duckdb.connect(":memory:" if in_memory else "duckdb.db")
+
+
+@functools.lru_cache
+def load_config(config_path: str) -> dict:
+    """Parse the TOML config at `config_path` once, however often we connect"""
     with open(config_path, "r") as f:
-        postgres_conf = toml.load(f)
+        return toml.load(f)
+
+
+def connect_postgres(config_path: str = "secrets/postgres-conf.toml") -> psycopg2.extensions.connection:
+    postgres_conf = load_config(config_path)
 
     return psycopg2.connect(**postgres_conf["postgres_conf"])
 
 
-def connect_snowflake() -> snowflake.connector.connection.SnowflakeConnection:
-    with open("secrets/snowflake-conf.toml", "r") as f:
-        snowflake_conf = toml.load(f)
+def connect_snowflake(config_path: str = "secrets/snowflake-conf.toml") -> snowflake.connector.connection.SnowflakeConnection:
+    snowflake_conf = load_config(config_path)
 
     return snowflake.connector.connect(**snowflake_conf["snowflake_conf"])
 
@@ -47,37 +139,52 @@ def connect_opendict(
     principal_secrets_path: str = "../polaris-boot/secrets",
     openidic_api_url: str = "http://localhost:8181/api",
     config_path: str = "secrets/snowflake-conf.toml",
+    pool_maxsize: int = 16,
 ) -> OpenDicSnowflakeCatalog:
-    snowflake_conn = snowflake_connect(config_path=config_path)
-    engineer_client_id = read_secret(secrets_path="../polaris-boot/secrets", secret_name="engineer-client-id")
-    engineer_client_secret = read_secret(secrets_path="../polaris-boot/secrets", secret_name="engineer-client-secret")
-    return OpenDicSnowflakeCatalog(
+    """Connect the OpenDic catalog. Its HTTP session keeps up to `pool_maxsize` connections alive, at least as many as
+    requests in flight, or the surplus connections are discarded and re-handshaked"""
+    snowflake_conn = connect_snowflake(config_path=config_path)  # Through the cached config
+    engineer_client_id = read_secret(secrets_path=principal_secrets_path, secret_name="engineer-client-id")
+    engineer_client_secret = read_secret(secrets_path=principal_secrets_path, secret_name="engineer-client-secret")
+    catalog = OpenDicSnowflakeCatalog(
         snowflake_conn=snowflake_conn,
         api_url=openidic_api_url,
         client_id=engineer_client_id,
         client_secret=engineer_client_secret,
     )
+    catalog.client = SessionOpenDicClient(catalog.client, pool_maxsize=pool_maxsize)
+    return catalog
+
+
+# Built once at import, not on every connect
+_STANDARD_CONNECTORS: dict[DatabaseSystem, Callable[[], Any]] = {
+    DatabaseSystem.SQLITE: connect_sqlite,
+    DatabaseSystem.DUCKDB: connect_duckdb,
+    DatabaseSystem.POSTGRES: connect_postgres,
+    DatabaseSystem.SNOWFLAKE: connect_snowflake,
+}
 
 
 def connect_standard_database(
     database_system: DatabaseSystem,
+    tuned_sqlite: bool = False,
+    duckdb_memory: bool = False,
 ) -> (
     sqlite3.Connection
     | duckdb.DuckDBPyConnection
     | psycopg2.extensions.connection
     | snowflake.connector.connection.SnowflakeConnection
 ):
-    """Connect to the specified database system and return the connection object"""
-    if database_system == DatabaseSystem.SQLITE:
-        return connect_sqlite()
-    elif database_system == DatabaseSystem.DUCKDB:
-        return connect_duckdb()
-    elif database_system == DatabaseSystem.POSTGRES:
-        return connect_postgres()
-    elif database_system == DatabaseSystem.SNOWFLAKE:
-        return connect_snowflake()
-    else:
+    """Connect to the specified database system and return the connection object.
+    tuned_sqlite applies the _SQLITE_TUNING_PRAGMAS to SQLite connections, duckdb_memory opens DuckDB in memory"""
+    if tuned_sqlite and database_system == DatabaseSystem.SQLITE:
+        return connect_sqlite(tuned=True)
+    if duckdb_memory and database_system == DatabaseSystem.DUCKDB:
+        return connect_duckdb(in_memory=True)
+    connect = _STANDARD_CONNECTORS.get(database_system)
+    if connect is None:
         raise ValueError(f"Unknown database system: {database_system}")
+    return connect()
 
 
 def close_database(
@@ -100,12 +207,91 @@ def close_database(
     elif database_system == DatabaseSystem.SNOWFLAKE and isinstance(conn, snowflake.connector.connection.SnowflakeConnection):
         conn.close()
     elif database_system in OPENDIC_EXPS and isinstance(conn, OpenDicSnowflakeCatalog):
-        # HTTP/REST only. Nothing to close.
-        pass
+        # HTTP/REST only. Release the keep-alive connections.
+        if isinstance(conn.client, SessionOpenDicClient):
+            conn.client.session.close()
+        # The catalog also holds the Snowflake connection it was created with
+        conn.conn.close()
     else:
         raise ValueError(f"Unknown database system: {database_system}")
 
 
+# Server-side prepared statements that already exist, per Postgres connection
+_prepared_statements: weakref.WeakKeyDictionary[psycopg2.extensions.connection, set[str]] = weakref.WeakKeyDictionary()
+
+
+def prepare_postgres_statement(conn: psycopg2.extensions.connection, name: str, query: str) -> str:
+    """PREPARE `query` as `name` once per connection (untimed) and return the EXECUTE statement that runs it.
+    `query` must be a single statement without a trailing semicolon"""
+    prepared = _prepared_statements.setdefault(conn, set())
+    if name not in prepared:
+        with conn.cursor() as postgres_curr:
+            postgres_curr.execute(f"PREPARE {name} AS {query}")
+        conn.commit()
+        prepared.add(name)
+    return f"EXECUTE {name};"
+
+
+def open_cursor(conn, database_system: DatabaseSystem) -> AbstractContextManager:
+    """Cursor to share across a loop of execute_timed_query calls on one thread (Postgres and Snowflake). Other systems
+    have no cursor and get None"""
+    if database_system in {DatabaseSystem.POSTGRES, DatabaseSystem.SNOWFLAKE}:
+        return conn.cursor()
+    return nullcontext()
+
+
+# Cost of the timer calls themselves, subtracted from every query time. 0 unless calibrate_timer_overhead() ran
+_timer_overhead_ns = 0
+
+
+def calibrate_timer_overhead(iterations: int = 100_000) -> int:
+    """Measure the median cost of an empty timed region and subtract it from every later query time. Opt-in, by default
+    the raw durations are recorded"""
+    global _timer_overhead_ns
+    samples = []
+    for _ in range(iterations):
+        start_ns = time.perf_counter_ns()
+        samples.append(time.perf_counter_ns() - start_ns)
+    _timer_overhead_ns = int(statistics.median(samples))
+    return _timer_overhead_ns
+
+
+def _execute_sqlite(conn: sqlite3.Connection, query: str, cursor=None):
+    conn.execute(query)
+    conn.commit()
+
+
+def _execute_duckdb(conn: duckdb.DuckDBPyConnection, query: str, cursor=None):
+    conn.execute(query)
+
+
+def _execute_postgres(conn: psycopg2.extensions.connection, query: str, cursor):
+    cursor.execute(query)
+    conn.commit()
+
+
+def _execute_snowflake(conn: snowflake.connector.connection.SnowflakeConnection, query: str, cursor):
+    cursor.execute(query)
+
+
+def _execute_opendic(conn: OpenDicSnowflakeCatalog, query: str, cursor=None):
+    response = conn.sql(query)
+    if isinstance(response, PrettyResponse):  # Might be error
+        assert "error" not in response.data.keys(), f"Error in response: {response.data}"
+    elif isinstance(response, DataFrame):
+        assert response.size > 0
+
+
+# Query executor per system. One dict lookup per query instead of walking a chain of system and isinstance checks
+_EXECUTORS: dict[DatabaseSystem, Callable[[Any, str, Any], None]] = {
+    DatabaseSystem.SQLITE: _execute_sqlite,
+    DatabaseSystem.DUCKDB: _execute_duckdb,
+    DatabaseSystem.POSTGRES: _execute_postgres,
+    DatabaseSystem.SNOWFLAKE: _execute_snowflake,
+    **dict.fromkeys(OPENDIC_EXPS, _execute_opendic),
+}
+
+
 def execute_timed_query(
     conn: sqlite3.Connection
     | duckdb.DuckDBPyConnection
@@ -114,40 +300,161 @@ def execute_timed_query(
     | OpenDicSnowflakeCatalog,
     database_system: DatabaseSystem,
     query: str,
+    cursor=None,
 ) -> tuple[datetime.datetime, datetime.datetime, datetime.timedelta]:
-    """Execute query and log the query time"""
+    """Execute query and log the query time. Only the execute (and commit) is timed.
+    Postgres and Snowflake run it on `cursor` if given (see open_cursor), otherwise on a new cursor per query"""
     _current_task_loading(query=query)
+    execute = _EXECUTORS[database_system]  # Looked up before the timer starts
 
-    start_time = datetime.datetime.now()
+    # Without a shared cursor, Postgres and Snowflake open one for this query, also before the timer starts
+    with open_cursor(conn, database_system) if cursor is None else nullcontext(cursor) as cursor:
+        start_time = datetime.datetime.now()  # Wall clock for the log only, the duration comes from perf_counter_ns
+        start_ns = time.perf_counter_ns()
 
-    if database_system == DatabaseSystem.SQLITE and isinstance(conn, sqlite3.Connection):
-        conn.execute(query)
-        conn.commit()
-    elif database_system == DatabaseSystem.DUCKDB and isinstance(conn, duckdb.DuckDBPyConnection):
-        conn.execute(query)
-    elif database_system == DatabaseSystem.POSTGRES and isinstance(conn, psycopg2.extensions.connection):
-        with conn.cursor() as postgres_curr:
-            postgres_curr.execute(query)
+        execute(conn, query, cursor)
+
+        query_time = datetime.timedelta(microseconds=max(0, time.perf_counter_ns() - start_ns - _timer_overhead_ns) / 1000)
+
+    return start_time, start_time + query_time, query_time
+
+
+def execute_timed_batch(
+    conn: sqlite3.Connection
+    | duckdb.DuckDBPyConnection
+    | psycopg2.extensions.connection
+    | snowflake.connector.connection.SnowflakeConnection,
+    database_system: DatabaseSystem,
+    queries: list[str],
+) -> tuple[datetime.datetime, datetime.datetime, datetime.timedelta]:
+    """Execute multiple statements in a single round trip and log the total batch time"""
+    _current_task_loading(query=queries[0])
+    batch_query = "\n".join(queries)
+
+    with open_cursor(conn, database_system) as cursor:  # Opened before the timer starts
+        start_time = datetime.datetime.now()
+        start_ns = time.perf_counter_ns()
+
+        if database_system == DatabaseSystem.SQLITE and isinstance(conn, sqlite3.Connection):
+            conn.executescript(batch_query)
             conn.commit()
-    elif database_system == DatabaseSystem.SNOWFLAKE and isinstance(conn, snowflake.connector.connection.SnowflakeConnection):
-        with conn.cursor() as snowflake_curr:
-            snowflake_curr.execute(query)
-    elif database_system in OPENDIC_EXPS and isinstance(conn, OpenDicSnowflakeCatalog):
-        response = conn.sql(query)
-        if isinstance(response, PrettyResponse):  # Might be error
-            assert "error" not in response.data.keys(), f"Error in response: {response.data}"
-        elif isinstance(response, DataFrame):
-            assert response.size > 0
+        elif database_system == DatabaseSystem.DUCKDB and isinstance(conn, duckdb.DuckDBPyConnection):
+            conn.execute(batch_query)
+        elif database_system == DatabaseSystem.POSTGRES and isinstance(conn, psycopg2.extensions.connection):
+            cursor.execute(batch_query)
+            conn.commit()
+        elif database_system == DatabaseSystem.SNOWFLAKE and isinstance(conn, snowflake.connector.connection.SnowflakeConnection):
+            cursor.execute(batch_query, num_statements=len(queries))
+        else:
+            raise ValueError(f"Batch execution not supported for: {database_system}")
+
+        query_time = datetime.timedelta(microseconds=max(0, time.perf_counter_ns() - start_ns - _timer_overhead_ns) / 1000)
+
+    return start_time, start_time + query_time, query_time
+
+
+def execute_timed_queries_concurrently(
+    conn: psycopg2.extensions.connection | snowflake.connector.connection.SnowflakeConnection | OpenDicSnowflakeCatalog,
+    database_system: DatabaseSystem,
+    queries: Iterable[str],
+    concurrency: int,
+) -> Iterator[tuple[datetime.datetime, datetime.datetime, datetime.timedelta]]:
+    """Execute queries with up to `concurrency` of them in flight at once. Yields the timings of each query in submission
+    order, so the caller can record them on its own thread.
+    Callers close the generator when their loop ends (contextlib.closing). That shuts the pool down and closes the per-thread
+    Postgres connections right away, not only when the generator is garbage collected"""
+    if database_system not in CONCURRENT_EXPS:
+        raise ValueError(f"Concurrent execution not supported for: {database_system}")
+
+    if database_system != DatabaseSystem.POSTGRES:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            yield from executor.map(lambda query: execute_timed_query(conn, database_system, query), queries)
+        return
+
+    # A psycopg2 connection runs one query at a time, so each worker thread opens a persistent connection of its own
+    local = threading.local()
+    worker_conns: list[psycopg2.extensions.connection] = []
+
+    def execute(query: str):
+        if not hasattr(local, "conn"):
+            local.conn = connect_postgres()
+            worker_conns.append(local.conn)
+        return execute_timed_query(local.conn, database_system, query)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            yield from executor.map(execute, queries)
+    finally:
+        for worker_conn in worker_conns:
+            worker_conn.close()
+
+
+def prefetch_queries(queries: Iterable[str], maxsize: int = 32) -> Iterator[str]:
+    """Build `queries` on a background thread, up to `maxsize` ahead of the consumer. Lets remote systems hide client-side
+    query generation behind the server round trip of the previous query"""
+    buffer: queue.Queue = queue.Queue(maxsize=maxsize)
+    done = object()
+    # Set when the consumer stops, also early on an error or a shorter zip partner, so the producer does not stay blocked
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for query in queries:
+                if not put(query):
+                    return
+        except Exception as e:  # Re-raised on the consumer thread
+            put(e)
+            return
+        put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while (item := buffer.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+# Latest query handed to _current_task_loading, shown by the progress thread
+_current_query: list[str | None] = [None]
+_progress_thread: threading.Thread | None = None
+_progress_lock = threading.Lock()
+# "\r" progress lines only make sense on a terminal. Piped or logged output (CI, docker logs) gets none
+_SHOW_PROGRESS = sys.stdout.isatty()
 
-    end_time = datetime.datetime.now()
 
-    return start_time, end_time, end_time - start_time
+def _current_task_loading(query: str):
+    """Set the query shown as "--running: {query}" in the terminal. The terminal write happens on a background thread
+    every 100 ms, so the query loops only pay for a list assignment"""
+    global _progress_thread
+    _current_query[0] = query
+    if _progress_thread is None and _SHOW_PROGRESS:
+        with _progress_lock:  # Concurrent experiments may get here from several threads
+            if _progress_thread is None:
+                _progress_thread = threading.Thread(target=_show_progress, name="progress", daemon=True)
+                _progress_thread.start()
 
 
-def _current_task_loading(query: str, max_length: int = 80):
-    """Simulate progress loading in terminal. Writes the following: "--running: {query}..." to terminal. The dots should blink while the query is running."""
-    lines: list[str] = query.split('\n')
-    first_line = lines[0] if len(lines) == 1 else lines[1]
+def _show_progress(max_length: int = 80, interval: float = 0.1):
+    shown = None
+    while True:
+        query = _current_query[0]
+        if query is not shown:
+            lines: list[str] = query.split('\n')
+            first_line = lines[0] if len(lines) == 1 else lines[1]
 
-    sys.stdout.write(f"\r--running: {first_line[:max_length]}")  # Truncate query to max_length
-    sys.stdout.flush()
+            sys.stdout.write(f"\r--running: {first_line[:max_length]}")  # Truncate query to max_length
+            sys.stdout.flush()
+            shown = query
+        time.sleep(interval)
@@ -1,4 +1,4 @@
-INSERT INTO snowflake
+INSERT INTO experiment_logs
 SELECT *
 FROM tmp_data;
 
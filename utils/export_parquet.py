@@ -3,11 +3,17 @@ import duckdb
 
 def export(table_name:str, output_path:str, db_name:str):
     con = duckdb.connect(db_name)
+    # Only export existing tables or views (the per-system log views), the name goes into the query text
+    known = {name for (name,) in con.execute('SELECT table_name FROM information_schema.tables').fetchall()}
+    if table_name not in known:
+        con.close()
+        raise ValueError(f"Unknown table: {table_name}. Available: {', '.join(sorted(known))}")
+    # DuckDB writes the row groups with all its threads. ZSTD compresses the repetitive query texts much better
     con.execute(f"""
         COPY (
           SELECT *
-          FROM {table_name}
-        ) TO '{output_path}' (FORMAT PARQUET)
+          FROM "{table_name}"
+        ) TO '{output_path}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 1048576)
     """)
     con.close()
 
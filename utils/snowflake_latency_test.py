@@ -1,15 +1,24 @@
+import statistics
+
 from opendic_benchmark.consts import DatabaseSystem
-from opendic_benchmark.runner import connect_snowflake, execute_timed_query
+from opendic_benchmark.runner import connect_snowflake, execute_timed_query, open_cursor
 
 
-def _get_snowflake_ping():
-    """Ping snowflake connection 10 time for average latency"""
-    with connect_snowflake() as conn:
-        total = 0
-        for i in range(10):
-            _, _, time = execute_timed_query(conn, DatabaseSystem.SNOWFLAKE, "SELECT 1;")
-            total += time.total_seconds()
-        return total / 10
+def _get_snowflake_ping(pings: int = 100) -> dict[str, float]:
+    """Ping snowflake connection `pings` times over one warmed connection. Returns mean and percentiles in seconds.
+    p99 is only reported from 100 pings on, with fewer samples it is just an interpolation near the maximum"""
+    with connect_snowflake() as conn, open_cursor(conn, DatabaseSystem.SNOWFLAKE) as cursor:
+        # Warm up, the first query also pays for session setup
+        execute_timed_query(conn, DatabaseSystem.SNOWFLAKE, "SELECT 1;", cursor=cursor)
+        times = []
+        for _ in range(pings):
+            _, _, time = execute_timed_query(conn, DatabaseSystem.SNOWFLAKE, "SELECT 1;", cursor=cursor)
+            times.append(time.total_seconds())
+    percentiles = statistics.quantiles(times, n=100, method="inclusive")
+    stats = {"mean": statistics.fmean(times), "p50": percentiles[49], "p90": percentiles[89]}
+    if pings >= 100:
+        stats["p99"] = percentiles[98]
+    return stats
 
 
 print(_get_snowflake_ping())